@@ -1,8 +1,10 @@
 import sqlite3
 import os
+import atexit
 import logging
-from typing import Optional, Tuple, List
+from typing import Iterator, Optional, Tuple, List
 from datetime import datetime
+from itertools import chain
 import sys
 sys.stdout.reconfigure(encoding="utf-8")
 
@@ -13,22 +15,77 @@ logger = logging.getLogger(__name__)
 # Database configuration
 DB_PATH = "data/emails.db"
 
+# Module-level singleton connection (opening a fresh handle per statement
+# forces a journal fsync on every commit, which dominates insert time).
+_conn: Optional[sqlite3.Connection] = None
+
+# Known gmail_ids, loaded lazily so duplicate rows are filtered in memory
+# before they ever hit the UNIQUE index. The constraint stays as a backstop.
+_known_gmail_ids: Optional[set] = None
+
 def ensure_data_directory():
     """Ensure the data directory exists."""
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
-def get_db_connection() -> Tuple[Optional[sqlite3.Connection], Optional[sqlite3.Cursor]]:
+def _get_conn() -> Optional[sqlite3.Connection]:
     """
-    Create a database connection and return connection and cursor.
+    Return the cached database connection, creating it on first use.
     """
+    global _conn
+    if _conn is not None:
+        return _conn
+
     try:
         ensure_data_directory()
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        return conn, cursor
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        atexit.register(conn.close)
+        _conn = conn
+        return _conn
     except Exception as e:
         logger.error(f"Error connecting to database: {e}")
+        return None
+
+def _get_known_gmail_ids() -> set:
+    """
+    Return the cached set of gmail_ids already stored, loading it on first use.
+    """
+    global _known_gmail_ids
+    if _known_gmail_ids is None:
+        conn = _get_conn()
+        if conn is None:
+            return set()
+        try:
+            _known_gmail_ids = {row[0] for row in conn.execute("SELECT gmail_id FROM emails")}
+        except sqlite3.OperationalError:
+            # Table not created yet.
+            _known_gmail_ids = set()
+    return _known_gmail_ids
+
+def _close_conn():
+    """Close and forget the cached connection (used when the file is recreated)."""
+    global _conn, _known_gmail_ids
+    _known_gmail_ids = None
+    if _conn is not None:
+        try:
+            atexit.unregister(_conn.close)
+            _conn.close()
+        except Exception as e:
+            logger.error(f"Error closing database connection: {e}")
+        _conn = None
+
+def get_db_connection() -> Tuple[Optional[sqlite3.Connection], Optional[sqlite3.Cursor]]:
+    """
+    Return the shared database connection and a fresh cursor.
+    """
+    conn = _get_conn()
+    if conn is None:
         return None, None
+    return conn, conn.cursor()
 
 def create_database() -> bool:
     """
@@ -36,6 +93,7 @@ def create_database() -> bool:
     """
     try:
         if os.path.exists(DB_PATH):
+            _close_conn()
             os.remove(DB_PATH)
             logger.info("Existing database deleted.")
 
@@ -57,9 +115,11 @@ def create_database() -> bool:
             )
         """)
 
+        # Covers WHERE read_status = ? ORDER BY received_date DESC without a
+        # separate sort step.
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_received_date 
-            ON emails(received_date)
+            CREATE INDEX IF NOT EXISTS idx_read_date
+            ON emails(read_status, received_date DESC)
         """)
 
         conn.commit()
@@ -70,10 +130,6 @@ def create_database() -> bool:
         logger.error(f"Error creating database: {e}")
         return False
 
-    finally:
-        if conn:
-            conn.close()
-
 def insert_email(gmail_id: str, sender: str, subject: str, message: str, folder: str, received_date: str) -> bool:
     """
     Insert email into the database.
@@ -89,7 +145,11 @@ def insert_email(gmail_id: str, sender: str, subject: str, message: str, folder:
         """, (gmail_id, sender, subject, message, folder, received_date))
 
         conn.commit()
-        logger.info(f"Email from {sender} successfully inserted into database")
+        _get_known_gmail_ids().add(gmail_id)
+        # Debug-gated with lazy %-formatting: per-row f-strings add up over
+        # large batches even when the message is never emitted.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Email from %s successfully inserted into database", sender)
         return True
 
     except sqlite3.IntegrityError:
@@ -100,38 +160,29 @@ def insert_email(gmail_id: str, sender: str, subject: str, message: str, folder:
         logger.error(f"Error inserting email: {e}")
         return False
 
-    finally:
-        if conn:
-            conn.close()
-
-def get_unread_emails() -> List[dict]:
+def get_unread_emails() -> Iterator[sqlite3.Row]:
     """
-    Retrieve all unread emails from the database.
+    Yield unread emails from the database, newest first.
+
+    Rows stream straight from the cursor as sqlite3.Row objects instead of
+    being materialized into a list of dicts, so memory stays flat no matter
+    how many unread emails there are.
     """
     try:
         conn, cursor = get_db_connection()
         if not conn or not cursor:
-            return []
+            return
 
-        cursor.execute("""
-            SELECT id, gmail_id, sender, subject, folder, received_date 
-            FROM emails 
+        yield from cursor.execute("""
+            SELECT id, gmail_id, sender, subject, folder, received_date
+            FROM emails
             WHERE read_status = 0
             ORDER BY received_date DESC
         """)
 
-        columns = [column[0] for column in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-
-        return results
-
     except Exception as e:
         logger.error(f"Error retrieving unread emails: {e}")
-        return []
 
-    finally:
-        if conn:
-            conn.close()
 def insert_many_emails(emails: List[dict]) -> bool:
     """
     Insert multiple emails into the database in a single transaction.
@@ -153,55 +204,88 @@ def insert_many_emails(emails: List[dict]) -> bool:
         if not conn or not cursor:
             return False
 
-        cursor.executemany("""
-            INSERT INTO emails (gmail_id, sender, subject, message, folder, received_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, [(email['gmail_id'], email['sender'], email['subject'], email['body'], "Inbox", email['date_received'])
-              for email in emails])
-
-        conn.commit()
-        logger.info(f"Successfully inserted {len(emails)} emails into the database.")
+        # Drop already-stored emails here instead of paying a bind/step per
+        # row for the UNIQUE index to reject them.
+        known = _get_known_gmail_ids()
+        rows = [(email['gmail_id'], email['sender'], email['subject'], email['body'], "Inbox", email['date_received'])
+                for email in emails if email['gmail_id'] not in known]
+
+        if not rows:
+            logger.info("All emails were already stored, nothing to insert.")
+            return True
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # SQLite caps bound parameters at 999; 6 columns per row → 166 rows/statement.
+            # A multi-row VALUES list runs one prepared statement per chunk instead of
+            # one bind/step cycle per row.
+            chunk_size = 999 // 6
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                placeholders = ",".join(["(?, ?, ?, ?, ?, ?)"] * len(chunk))
+                cursor.execute(f"""
+                    INSERT OR IGNORE INTO emails (gmail_id, sender, subject, message, folder, received_date)
+                    VALUES {placeholders}
+                """, list(chain.from_iterable(chunk)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        known.update(row[0] for row in rows)
+        logger.info(f"Successfully inserted {len(rows)} emails into the database.")
         return True
 
-    except sqlite3.IntegrityError:
-        logger.warning("Some emails were duplicates and were not inserted.")
-        return False
-
     except Exception as e:
         logger.error(f"Error inserting multiple emails: {e}")
         return False
 
-    finally:
-        if conn:
-            conn.close()
-
 
-def update_email_status(email_id: int, read_status: bool) -> bool:
+def bulk_update_status(email_ids: List[int], read_status: bool) -> bool:
     """
-    Update email read status.
+    Update read status for many emails in one transaction.
+
+    A single UPDATE ... WHERE id IN (...) per chunk means one fsync per
+    batch instead of one per email.
     """
+    if not email_ids:
+        return True
+
     try:
         conn, cursor = get_db_connection()
         if not conn or not cursor:
             return False
 
-        cursor.execute("""
-            UPDATE emails 
-            SET read_status = ? 
-            WHERE id = ?
-        """, (read_status, email_id))
-
-        conn.commit()
-        logger.info(f"Email ID {email_id} marked as {'Read' if read_status else 'Unread'}")
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # 999 bound-parameter limit, minus one for the status value.
+            chunk_size = 998
+            for start in range(0, len(email_ids), chunk_size):
+                chunk = email_ids[start:start + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"""
+                    UPDATE emails
+                    SET read_status = ?
+                    WHERE id IN ({placeholders})
+                """, [read_status, *chunk])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        logger.info(f"Marked {len(email_ids)} emails as {'Read' if read_status else 'Unread'}")
         return True
 
     except Exception as e:
-        logger.error(f"Error updating email status: {e}")
+        logger.error(f"Error updating email statuses: {e}")
         return False
 
-    finally:
-        if conn:
-            conn.close()
+
+def update_email_status(email_id: int, read_status: bool) -> bool:
+    """
+    Update a single email's read status.
+    """
+    return bulk_update_status([email_id], read_status)
 
 if __name__ == "__main__":
     if create_database():
@@ -224,12 +308,13 @@ if __name__ == "__main__":
         ):
             print("Test email inserted successfully")
 
-        unread_emails = get_unread_emails()
+        first_email_id = None
         print("Unread Emails:")
-        for email in unread_emails:
-            print(email)
+        for email in get_unread_emails():
+            if first_email_id is None:
+                first_email_id = email['id']
+            print(dict(email))
 
-        if unread_emails:
-            first_email_id = unread_emails[0]['id']
+        if first_email_id is not None:
             if update_email_status(first_email_id, True):
                 print(f"Marked email ID {first_email_id} as Read")
@@ -1,7 +1,9 @@
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import base64
+import binascii
 import logging
+import random
+import time
 from typing import List, Dict, Any
 from gmail_auth import authenticate_gmail
 from database import insert_many_emails
@@ -9,6 +11,58 @@ from database import insert_many_emails
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Gmail's batch endpoint accepts at most 100 subrequests per call.
+BATCH_SIZE = 100
+
+# Retry attempts for messages rejected with a rate-limit error.
+MAX_ATTEMPTS = 5
+
+# Urlsafe-to-standard base64 alphabet translation, built once.
+_URLSAFE_TRANS = bytes.maketrans(b"-_", b"+/")
+
+def _decode_body(body_data: str) -> str:
+    """
+    Decode a urlsafe-base64 message body straight through binascii.
+    Appending '==' tolerates the unpadded data Gmail returns.
+    """
+    try:
+        raw = body_data.encode("ascii").translate(_URLSAFE_TRANS)
+        return binascii.a2b_base64(raw + b"==").decode("utf-8", "ignore")
+    except (binascii.Error, UnicodeEncodeError) as e:
+        logger.error(f"Error decoding message body: {e}")
+        return ""
+
+def _parse_message(msg_detail: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extract sender, subject, date and plain-text body from a messages.get response.
+    """
+    # One pass over the header list instead of a linear scan per field.
+    hmap = {h["name"].lower(): h["value"] for h in msg_detail["payload"]["headers"]}
+
+    email_data = {
+        "gmail_id": msg_detail["id"],  # ✅ Ensure Gmail ID is stored
+        "sender": hmap.get("from", "Unknown"),
+        "subject": hmap.get("subject", "No Subject"),
+        "date_received": hmap.get("date", "Unknown"),
+        "body": ""
+    }
+
+    # Handle different payload structures
+    payload = msg_detail.get("payload", {})
+    if "parts" in payload:
+        for part in payload["parts"]:
+            if part.get("mimeType") == "text/plain":
+                body_data = part.get("body", {}).get("data", "")
+                if body_data:
+                    email_data["body"] = _decode_body(body_data)
+                    break
+    elif "body" in payload:
+        body_data = payload["body"].get("data", "")
+        if body_data:
+            email_data["body"] = _decode_body(body_data)
+
+    return email_data
+
 def fetch_emails(max_results: int = 20) -> List[Dict[str, Any]]:
     """
     Fetch emails from Gmail and prepare them for database storage.
@@ -30,39 +84,51 @@ def fetch_emails(max_results: int = 20) -> List[Dict[str, Any]]:
 
         messages = results.get("messages", [])
         processed_emails = []
+        rate_limited = []
 
-        for msg in messages:
+        def _on_msg(request_id, response, exception):
+            if exception is not None:
+                if isinstance(exception, HttpError) and exception.resp.status == 429:
+                    rate_limited.append(request_id)
+                else:
+                    logger.error(f"Error processing message {request_id}: {exception}")
+                return
             try:
-                msg_detail = service.users().messages().get(userId="me", id=msg["id"]).execute()
-                headers = msg_detail["payload"]["headers"]
-
-                email_data = {
-                    "gmail_id": msg["id"],  # ✅ Ensure Gmail ID is stored
-                    "sender": next((h["value"] for h in headers if h["name"].lower() == "from"), "Unknown"),
-                    "subject": next((h["value"] for h in headers if h["name"].lower() == "subject"), "No Subject"),
-                    "date_received": next((h["value"] for h in headers if h["name"].lower() == "date"), "Unknown"),
-                    "body": ""
-                }
-
-                # Handle different payload structures
-                payload = msg_detail.get("payload", {})
-                if "parts" in payload:
-                    for part in payload["parts"]:
-                        if part.get("mimeType") == "text/plain":
-                            body_data = part.get("body", {}).get("data", "")
-                            if body_data:
-                                email_data["body"] = base64.urlsafe_b64decode(body_data).decode("utf-8", "ignore")
-                                break
-                elif "body" in payload:
-                    body_data = payload["body"].get("data", "")
-                    if body_data:
-                        email_data["body"] = base64.urlsafe_b64decode(body_data).decode("utf-8", "ignore")
-
-                processed_emails.append(email_data)
-
+                processed_emails.append(_parse_message(response))
             except Exception as e:
-                logger.error(f"Error processing message {msg['id']}: {e}")
-                continue
+                logger.error(f"Error processing message {request_id}: {e}")
+
+        # One batch HTTP request multiplexes up to 100 messages.get calls,
+        # instead of one HTTPS round trip per message. Messages rejected with
+        # 429 are retried with exponential backoff plus jitter.
+        pending = [msg["id"] for msg in messages]
+        for attempt in range(MAX_ATTEMPTS):
+            if not pending:
+                break
+            if attempt > 0:
+                time.sleep(min(2 ** attempt, 32) + random.random())
+                logger.warning(f"Retrying {len(pending)} rate-limited messages (attempt {attempt + 1})")
+
+            rate_limited.clear()
+            for start in range(0, len(pending), BATCH_SIZE):
+                batch = service.new_batch_http_request(callback=_on_msg)
+                for msg_id in pending[start:start + BATCH_SIZE]:
+                    # Partial response: only the headers and text bodies we parse,
+                    # not attachments or HTML parts.
+                    batch.add(
+                        service.users().messages().get(
+                            userId="me",
+                            id=msg_id,
+                            format="full",
+                            fields="id,payload/headers,payload/parts(mimeType,body/data),payload/body/data"
+                        ),
+                        request_id=msg_id
+                    )
+                batch.execute()
+            pending = list(rate_limited)
+
+        if pending:
+            logger.error(f"Giving up on {len(pending)} messages after {MAX_ATTEMPTS} attempts")
 
         return processed_emails
 
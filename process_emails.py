@@ -1,25 +1,44 @@
 import json
+import os
+import pickle
+import random
+import re
+import time
 from datetime import datetime, timedelta, timezone
 from email.utils import parsedate_to_datetime
 from gmail_auth import authenticate_gmail
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from typing import Dict, Any, List
 from fetch_emails import fetch_emails
 import logging
 
 RULES_FILE = "rules.json"
 
+# batchModify accepts at most 1000 message ids per call.
+BATCH_MODIFY_LIMIT = 1000
+
+# Label name→id cache persisted between runs; saves one labels.list round
+# trip per process start while the file is younger than the TTL.
+LABEL_CACHE_FILE = "data/labels.pkl"
+LABEL_CACHE_TTL = 3600  # seconds
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class EmailProcessor:
     def __init__(self):
-        self.rules = self._load_rules()
+        self.rules = self._prepare_rules(self._load_rules())
         self.service = None
         self.total_processed = 0
         self.total_matched = 0
+        # Reference time for relative date rules; refreshed per processing run.
+        self._now = datetime.now(timezone.utc)
         self._init_gmail_service()
         self.label_cache = self._get_existing_labels()
+        # Accumulated label changes, keyed by (addLabelIds, removeLabelIds)
+        # so identical changes across emails collapse into one batchModify.
+        self.pending_modifications = {}
         self.system_labels = {
             'SPAM': 'SPAM',
             'TRASH': 'TRASH',
@@ -37,6 +56,48 @@ class EmailProcessor:
             logger.error(f"❌ Error loading rules file: {e}")
             return []
 
+    def _prepare_rules(self, rules: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Normalize rules once so the per-email matching loop does no string
+        preparation: lowercase field/condition names, pre-lower From/Subject
+        values into tuples, and precompile multi-keyword "contains"
+        conditions into one alternation regex (a single C-level scan of the
+        text instead of one substring search per keyword).
+        """
+        for rule_set in rules:
+            for cond in rule_set.get("conditions", []):
+                cond["field"] = cond.get("field", "").lower()
+                cond["condition"] = cond.get("condition", "").lower()
+
+                values = cond.get("value")
+                if isinstance(values, str):
+                    values = [values]
+
+                if cond["field"] in ("from", "subject") and values:
+                    cond["value"] = tuple(v.lower() for v in values)
+                    if cond["condition"] == "contains":
+                        cond["_contains_re"] = re.compile(
+                            "|".join(re.escape(v) for v in cond["value"])
+                        )
+
+                elif cond["field"] == "received date":
+                    # Parse "last N days" / "older than N days" once here so
+                    # the matching loop only compares datetimes.
+                    parts = cond["condition"].split()
+                    try:
+                        if cond["condition"].startswith("last"):
+                            cond["_date_op"] = "last"
+                            cond["_delta"] = timedelta(days=int(parts[1]))
+                        elif cond["condition"].startswith("older than"):
+                            cond["_date_op"] = "older"
+                            cond["_delta"] = timedelta(days=int(parts[2]))
+                    except (ValueError, IndexError):
+                        logger.error(f"❌ Invalid date condition: {cond['condition']}")
+                    if cond["condition"] == "month":
+                        cond["_month_key"] = str(cond.get("value", "")).replace(" ", "_").lower()
+
+        return rules
+
     def _init_gmail_service(self):
         try:
             creds = authenticate_gmail()
@@ -46,28 +107,43 @@ class EmailProcessor:
             logger.error(f"❌ Failed to initialize Gmail service: {e}")
             raise
 
-    def _match_string_condition(self, condition: str, values: List[str], text: str) -> bool:
+    def _call_with_retry(self, request, max_attempts: int = 5):
+        """Execute a Gmail API request, retrying transient errors with backoff."""
+        for attempt in range(max_attempts):
+            try:
+                return request.execute()
+            except HttpError as e:
+                if e.resp.status not in (429, 500, 503) or attempt == max_attempts - 1:
+                    raise
+                delay = min(2 ** attempt, 32) + random.uniform(0, 1)
+                logger.warning(f"⚠️ Transient error {e.resp.status}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _match_string_condition(self, condition: str, values: tuple, text: str,
+                                contains_re: re.Pattern = None) -> bool:
+        """
+        Match an already-lowercased text against pre-lowered rule values.
+        """
         if not text or not values:
             return False
 
-        text = text.lower()
-        condition = condition.lower()
-
         # For debugging
         logger.debug(f"Matching text: '{text}' against values: {values} using condition: {condition}")
 
         result = False
-        if isinstance(values, str):
-            values = [values]
-
         if condition == "contains":
-            result = any(val.lower() in text for val in values)
+            if contains_re is not None:
+                result = contains_re.search(text) is not None
+            else:
+                result = any(val in text for val in values)
         elif condition == "startswith":
-            result = any(text.startswith(val.lower()) for val in values)
+            # values is a tuple from _prepare_rules; str.startswith takes the
+            # whole tuple and short-circuits in C instead of a Python loop.
+            result = text.startswith(values)
         elif condition == "endswith":
-            result = any(text.endswith(val.lower()) for val in values)
+            result = text.endswith(values)
         elif condition == "equals":
-            result = any(text == val.lower() for val in values)
+            result = text in values
         elif condition == "noreply":
             result = "noreply" in text or "no-reply" in text
 
@@ -76,6 +152,7 @@ class EmailProcessor:
 
     def process_emails(self):
         logger.info("🔄 Starting email processing...")
+        self._now = datetime.now(timezone.utc)
         emails = fetch_emails(max_results=10)
         self.total_processed = len(emails)
         self.total_matched = 0
@@ -93,6 +170,9 @@ class EmailProcessor:
             except Exception as e:
                 logger.error(f"❌ Error processing email: {e}")
 
+        # One batchModify per distinct label change instead of one modify per email.
+        self._flush_pending_modifications()
+
         print("\n" + "="*50)  # Separator for better readability
         logger.info(f"✅ Summary: Processed {self.total_processed} emails, {self.total_matched} matched rules.")
 
@@ -113,6 +193,13 @@ class EmailProcessor:
             logger.error(f"❌ Error parsing date '{received_date}': {e}")
             return False
 
+        # Lowercase once per email instead of once per rule condition.
+        sender_lc = sender.lower()
+        subject_lc = subject.lower()
+
+        # Label changes from all matched rules merge into one modification.
+        add_labels, remove_labels = set(), set()
+
         matched_any_rule = False
         for rule_index, rule_set in enumerate(self.rules, 1):
             predicate = rule_set.get("predicate", "ANY").upper()
@@ -122,51 +209,48 @@ class EmailProcessor:
             if not conditions:
                 continue
 
-            matches = []
-            for condition in conditions:
-                match = self._match_rule(condition, sender, subject, email_date)
-                matches.append(match)
-
+            # Generator lets ALL stop at the first failed condition and ANY
+            # at the first match instead of evaluating every condition.
+            matches = (self._match_rule(condition, sender_lc, subject_lc, email_date)
+                       for condition in conditions)
             rule_matched = all(matches) if predicate == "ALL" else any(matches)
 
             if rule_matched:
                 print(f"\n✨ Matched Rule #{rule_index}:")
                 print(f"   Predicate: {predicate}")
-                self._apply_rule_action(gmail_id, action)
+                adds, removes = self._apply_rule_action(action)
+                add_labels.update(adds)
+                remove_labels.update(removes)
                 matched_any_rule = True
                 self.total_matched += 1
 
+        if add_labels or remove_labels:
+            key = (tuple(sorted(add_labels)), tuple(sorted(remove_labels)))
+            self.pending_modifications.setdefault(key, []).append(gmail_id)
+
         if not matched_any_rule:
             print("   ℹ️ No rules matched")
 
         return matched_any_rule
 
-    def _match_rule(self, rule: Dict[str, Any], sender: str, subject: str, email_date: datetime) -> bool:
-        field = rule["field"].lower()
-        condition = rule["condition"].lower()
+    def _match_rule(self, rule: Dict[str, Any], sender_lc: str, subject_lc: str, email_date: datetime) -> bool:
+        field = rule["field"]
+        condition = rule["condition"]
         value = rule["value"]
 
         if field == "from":
-            return self._match_string_condition(condition, value, sender)
+            return self._match_string_condition(condition, value, sender_lc, rule.get("_contains_re"))
         elif field == "subject":
-            return self._match_string_condition(condition, value, subject)
+            return self._match_string_condition(condition, value, subject_lc, rule.get("_contains_re"))
         elif field == "received date":
-            now = datetime.now(timezone.utc)
-            
-            if condition.startswith("last"):
-                try:
-                    days = int(condition.split()[1])
-                    return email_date >= now - timedelta(days=days)
-                except (ValueError, IndexError):
-                    return False
-            elif condition.startswith("older than"):
-                try:
-                    days = int(condition.split()[2])
-                    return email_date <= now - timedelta(days=days)
-                except (ValueError, IndexError):
-                    return False
+            date_op = rule.get("_date_op")
+
+            if date_op == "last":
+                return email_date >= self._now - rule["_delta"]
+            elif date_op == "older":
+                return email_date <= self._now - rule["_delta"]
             elif condition == "month":
-                return email_date.strftime("%B_%Y").lower() == value.replace(" ", "_").lower()
+                return email_date.strftime("%B_%Y").lower() == rule["_month_key"]
             elif condition == "year":
                 return email_date.strftime("%Y") == value
             elif condition == "equals":
@@ -174,71 +258,102 @@ class EmailProcessor:
 
         return False
 
-    def _apply_rule_action(self, gmail_id: str, action: Dict[str, Any]):
+    def _apply_rule_action(self, action: Dict[str, Any]) -> tuple:
+        """Translate a rule action into (add_labels, remove_labels) id sets."""
         action_type = action.get("type")
+        add_labels, remove_labels = set(), set()
         try:
             if action_type == "MarkAsRead":
-                self.service.users().messages().modify(
-                    userId="me",
-                    id=gmail_id,
-                    body={"removeLabelIds": ["UNREAD"]}
-                ).execute()
+                remove_labels.add("UNREAD")
                 print(f"   📖 Action: Marked as Read")
 
             elif action_type == "MoveTo":
                 folder = action.get("folder")
                 if folder.upper() in self.system_labels:
-                    self.service.users().messages().modify(
-                        userId="me",
-                        id=gmail_id,
-                        body={"addLabelIds": [self.system_labels[folder.upper()]]}
-                    ).execute()
+                    add_labels.add(self.system_labels[folder.upper()])
                 else:
-                    self._apply_label(gmail_id, folder)
+                    label_id = self._resolve_label_id(folder)
+                    if label_id:
+                        add_labels.add(label_id)
                 print(f"   📂 Action: Moved to {folder}")
 
             elif action_type == "Archive":
-                self.service.users().messages().modify(
-                    userId="me",
-                    id=gmail_id,
-                    body={"removeLabelIds": ["INBOX"]}
-                ).execute()
+                remove_labels.add("INBOX")
                 print(f"   📦 Action: Archived")
 
             elif action_type == "CreateLabel":
                 label_name = action.get("label")
-                self._create_label(label_name)
-                self._apply_label(gmail_id, label_name)
+                label_id = self._resolve_label_id(label_name)
+                if label_id:
+                    add_labels.add(label_id)
                 print(f"   🏷️ Action: Created/Applied label '{label_name}'")
 
         except Exception as e:
             logger.error(f"❌ Error applying action {action_type}: {e}")
 
-    def _apply_label(self, gmail_id: str, label_name: str):
-        label_name = label_name.upper()
-        if label_name not in self.label_cache:
-            self._create_label(label_name)
+        return add_labels, remove_labels
 
-        try:
-            label_id = self.label_cache[label_name]
-            self.service.users().messages().modify(
-                userId="me",
-                id=gmail_id,
-                body={"addLabelIds": [label_id]}
-            ).execute()
-        except Exception as e:
-            logger.error(f"❌ Error applying label '{label_name}': {e}")
+    def _flush_pending_modifications(self):
+        """Apply all accumulated label changes, one batchModify per distinct change."""
+        for (add_labels, remove_labels), gmail_ids in self.pending_modifications.items():
+            body = {}
+            if add_labels:
+                body["addLabelIds"] = list(add_labels)
+            if remove_labels:
+                body["removeLabelIds"] = list(remove_labels)
+
+            try:
+                for start in range(0, len(gmail_ids), BATCH_MODIFY_LIMIT):
+                    chunk = gmail_ids[start:start + BATCH_MODIFY_LIMIT]
+                    self._call_with_retry(self.service.users().messages().batchModify(
+                        userId="me",
+                        body={"ids": chunk, **body}
+                    ))
+            except Exception as e:
+                logger.error(f"❌ Error applying batched label changes: {e}")
+
+        self.pending_modifications.clear()
+
+    def _resolve_label_id(self, label_name: str) -> str:
+        """Return the Gmail label id for a name, creating the label if needed."""
+        if label_name.upper() not in self.label_cache:
+            self._create_label(label_name)
+        return self.label_cache.get(label_name.upper())
 
     def _get_existing_labels(self) -> Dict[str, str]:
+        cached = self._load_label_cache()
+        if cached is not None:
+            return cached
+
         try:
-            response = self.service.users().labels().list(userId="me").execute()
+            response = self._call_with_retry(self.service.users().labels().list(userId="me"))
             labels = {label["name"].upper(): label["id"] for label in response.get("labels", [])}
             logger.info(f"✅ Retrieved {len(labels)} existing labels")
+            self._save_label_cache(labels)
             return labels
         except Exception as e:
             logger.error(f"❌ Error fetching labels: {e}")
             return {}
 
+    def _load_label_cache(self) -> Dict[str, str]:
+        try:
+            if os.path.exists(LABEL_CACHE_FILE) and time.time() - os.path.getmtime(LABEL_CACHE_FILE) < LABEL_CACHE_TTL:
+                with open(LABEL_CACHE_FILE, "rb") as file:
+                    labels = pickle.load(file)
+                logger.info(f"✅ Loaded {len(labels)} labels from cache")
+                return labels
+        except Exception as e:
+            logger.error(f"❌ Error reading label cache: {e}")
+        return None
+
+    def _save_label_cache(self, labels: Dict[str, str]):
+        try:
+            os.makedirs(os.path.dirname(LABEL_CACHE_FILE), exist_ok=True)
+            with open(LABEL_CACHE_FILE, "wb") as file:
+                pickle.dump(labels, file)
+        except Exception as e:
+            logger.error(f"❌ Error writing label cache: {e}")
+
     def _create_label(self, label_name: str):
         try:
             if label_name.upper() in self.label_cache:
@@ -250,9 +365,15 @@ class EmailProcessor:
                 "messageListVisibility": "show"
             }
 
-            response = self.service.users().labels().create(userId="me", body=label_body).execute()
+            response = self._call_with_retry(self.service.users().labels().create(userId="me", body=label_body))
             self.label_cache[label_name.upper()] = response["id"]
             logger.info(f"✅ Created new label: {label_name}")
+
+            # The persisted cache no longer reflects the server's labels.
+            try:
+                os.remove(LABEL_CACHE_FILE)
+            except OSError:
+                pass
         except Exception as e:
             logger.error(f"❌ Error creating label '{label_name}': {e}")
 